@@ -5,13 +5,82 @@ import os
 import yaml
 import torch
 import numpy as np
-from torch.utils.data import Dataset, DataLoader
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import Dataset, DataLoader, get_worker_info
 import lightning.pytorch as pl
 import sys
 
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
+
+from utils import _getitem_numba
 from utils.projection import projection
 from utils.preprocess_data import prepare_data, compute_mean_and_std
-from utils.utils import load_files
+from utils.utils import load_files, foreground_lut
+
+
+_IO_POOL = None
+
+
+def _io_pool():
+    """Shared thread pool for intra-sample frame reads
+
+    np.load releases the GIL during the file read, so decoding the frames
+    of one window in parallel stacks on top of the process-level
+    parallelism of the DataLoader workers. Created lazily so that every
+    worker process builds its own pool after fork.
+    """
+    global _IO_POOL
+    if _IO_POOL is None:
+        _IO_POOL = ThreadPoolExecutor(max_workers=4)
+    return _IO_POOL
+
+
+def worker_init_nuscenes(worker_id):
+    """Per-worker init: compile the window-packing kernel after the fork
+
+    Running a parallel Numba region in the parent and then forking is only
+    safe under the TBB threading layer, so the warmup must happen inside
+    each worker. With cache=True the per-worker compile is a cheap cache
+    load, and with num_workers=0 the first pack_window call compiles
+    lazily in the main process.
+    """
+    _getitem_numba.warmup()
+
+
+def collate_nuscenes(batch):
+    """Collate samples into one preallocated batch tensor per key
+
+    The past/fut windows have fixed shapes, so each key gets a single
+    (B,T,4,H,W) allocation that the samples are copied into, without
+    default_collate's per-key type dispatch. The meta entries become
+    per-field index tensors as with default_collate. When collate runs in
+    the main process (num_workers=0) the buffers are allocated pinned so
+    the H2D copy can be asynchronous; inside worker processes pinning is
+    left to the DataLoader's pin_memory thread, since initializing CUDA in
+    a forked worker is not safe.
+    """
+    pin = get_worker_info() is None and torch.cuda.is_available()
+    past_batch = torch.empty(
+        (len(batch),) + batch[0]["past_data"].shape, pin_memory=pin
+    )
+    fut_batch = torch.empty(
+        (len(batch),) + batch[0]["fut_data"].shape, pin_memory=pin
+    )
+    for i, sample in enumerate(batch):
+        past_batch[i].copy_(sample["past_data"])
+        fut_batch[i].copy_(sample["fut_data"])
+    return {
+        "past_data": past_batch,
+        "fut_data": fut_batch,
+        "meta": [
+            torch.tensor([sample["meta"][0] for sample in batch]),
+            torch.tensor([sample["meta"][1] for sample in batch]),
+        ],
+    }
 
 
 class NuScenesModule(pl.LightningDataModule):
@@ -44,16 +113,33 @@ class NuScenesModule(pl.LightningDataModule):
         test_set = NuScenesRaw(self.cfg, split="test")
 
         ########## Generate dataloaders and iterables
+        num_workers = self.cfg["DATA_CONFIG"]["DATALOADER"]["NUM_WORKER"]
+
+        # Worker-only options: prefetching future batches keeps the GPU fed
+        # when __getitem__ is I/O bound, pinning directly to the target device
+        # enables non-blocking H2D transfers
+        worker_kwargs = {}
+        if num_workers > 0:
+            worker_kwargs["prefetch_factor"] = self.cfg["DATA_CONFIG"]["DATALOADER"].get(
+                "PREFETCH_FACTOR", 4
+            )
+        pin_memory_device = self.cfg["DATA_CONFIG"]["DATALOADER"].get(
+            "PIN_MEMORY_DEVICE", ""
+        )
 
         self.train_loader = DataLoader(
             dataset=train_set,
             batch_size=self.cfg["TRAIN"]["BATCH_SIZE"],
             shuffle=self.cfg["DATA_CONFIG"]["DATALOADER"]["SHUFFLE"],
-            num_workers=self.cfg["DATA_CONFIG"]["DATALOADER"]["NUM_WORKER"],
+            num_workers=num_workers,
             pin_memory=True,
+            pin_memory_device=pin_memory_device,
             drop_last=False,
             timeout=0,
-            persistent_workers=True
+            persistent_workers=True,
+            collate_fn=collate_nuscenes,
+            worker_init_fn=worker_init_nuscenes,
+            **worker_kwargs
         )
         self.train_iter = iter(self.train_loader)
 
@@ -61,11 +147,15 @@ class NuScenesModule(pl.LightningDataModule):
             dataset=val_set,
             batch_size=self.cfg["TRAIN"]["BATCH_SIZE"],
             shuffle=False,
-            num_workers=self.cfg["DATA_CONFIG"]["DATALOADER"]["NUM_WORKER"],
+            num_workers=num_workers,
             pin_memory=True,
+            pin_memory_device=pin_memory_device,
             drop_last=False,
             timeout=0,
-            persistent_workers=True
+            persistent_workers=True,
+            collate_fn=collate_nuscenes,
+            worker_init_fn=worker_init_nuscenes,
+            **worker_kwargs
         )
         self.valid_iter = iter(self.valid_loader)
 
@@ -73,11 +163,15 @@ class NuScenesModule(pl.LightningDataModule):
             dataset=test_set,
             batch_size=self.cfg["TRAIN"]["BATCH_SIZE"],
             shuffle=False,
-            num_workers=self.cfg["DATA_CONFIG"]["DATALOADER"]["NUM_WORKER"],
+            num_workers=num_workers,
             pin_memory=True,
+            pin_memory_device=pin_memory_device,
             drop_last=False,
             timeout=0,
-            persistent_workers=True
+            persistent_workers=True,
+            collate_fn=collate_nuscenes,
+            worker_init_fn=worker_init_nuscenes,
+            **worker_kwargs
         )
         self.test_iter = iter(self.test_loader)
 
@@ -115,6 +209,7 @@ class NuScenesRaw(Dataset):
             Exception: [description]
         """
         self.cfg = cfg
+        self.split = split
         self.root_dir = self.cfg["DATA_CONFIG"]["PROCESSED_PATH"]
         self.height = self.cfg["DATA_CONFIG"]["HEIGHT"]
         self.width = self.cfg["DATA_CONFIG"]["WIDTH"]
@@ -126,6 +221,33 @@ class NuScenesRaw(Dataset):
         # Projection class for mapping from range image to 3D point cloud
         self.projection = projection(self.cfg)
 
+        # Per-worker LRU cache over single frames. Adjacent samples share all
+        # but one frame, so sequential val/test iteration gets high hit rates.
+        # The cache is skipped for the shuffled train split where hits are rare.
+        cache_size = self.cfg["DATA_CONFIG"]["DATALOADER"].get("FRAME_CACHE", 0)
+        self._frame_cache_size = 0 if split == "train" else cache_size
+        self._frame_cache = OrderedDict()
+
+        # Foreground semantic labels as a flat lookup table, so the
+        # per-pixel chain of comparisons in load_intensity becomes one gather
+        self._fg_lut = foreground_lut()
+
+        # Reusable scratch buffers for window packing, one ring per window
+        # length. A worker assembles a full batch before collate copies the
+        # samples out, and each sample draws two buffers (past and future
+        # window, which share a ring when the window lengths are equal), so
+        # the ring must hold two buffers per sample of a batch; anything
+        # smaller would be overwritten mid-batch.
+        self._scratch_pool = {}
+        self._scratch_size = max(1, 2 * int(self.cfg["TRAIN"]["BATCH_SIZE"]))
+
+        # Optional LMDB storage built with utils/pack_to_lmdb.py. Only the
+        # path is resolved here; LMDB environments are not fork-safe, so
+        # the handle is opened lazily in each DataLoader worker.
+        self._lmdb_path = os.path.join(self.root_dir, "lmdb_" + split)
+        self._lmdb_env = None
+        self._use_lmdb = lmdb is not None and os.path.exists(self._lmdb_path)
+
         if split == "train":
             start = self.cfg["DATA_CONFIG"]["SPLIT"]["TRAIN"][0]["START"]
             end = self.cfg["DATA_CONFIG"]["SPLIT"]["TRAIN"][1]["END"]
@@ -142,46 +264,70 @@ class NuScenesRaw(Dataset):
         self.sequences = np.arange(start, end+1)
         self.filenames_range = {}
         self.filenames_xyz = {}
-        self.filenames_intensity = {}
-        self.filenames_semantic = {}
 
-        # Create a dict idx_mapper that maps from a dataset idx to a sequence number and the index of the current scan
-        self.dataset_size = 0
-        self.idx_mapper = {}
-        idx = 0
+        # Columnar mapping from a dataset idx to a sequence number and the
+        # index of the current scan: two int32 arrays instead of a dict of
+        # tuples, avoiding per-lookup hashing and tuple allocation
+        samples_per_seq = []
+        self._seq_tensor = {}
         for seq in self.sequences:
             seqstr = "{0:03d}".format(int(seq))
-            scan_path_range = os.path.join(self.root_dir, seqstr, "processed", "range")
-            self.filenames_range[seq] = load_files(scan_path_range)
-
-            scan_path_xyz = os.path.join(self.root_dir, seqstr, "processed", "xyz")
-            self.filenames_xyz[seq] = load_files(scan_path_xyz)
-            assert len(self.filenames_range[seq]) == len(self.filenames_xyz[seq])
-
-            scan_path_intensity = os.path.join(
-                self.root_dir, seqstr, "processed", "intensity"
-            )
-            scan_path_semantic = os.path.join(
-                self.root_dir, seqstr, "processed", "semantic"
-            )
-            # self.filenames_semantic[seq] = load_files(scan_path_semantic)
-            # assert len(self.filenames_range[seq]) == len(self.filenames_semantic[seq])
+            processed_path = os.path.join(self.root_dir, seqstr, "processed")
+
+            # Prefer the packed per-sequence shard written at preprocessing
+            # time. One mmap per sequence avoids a syscall per frame and lets
+            # the page cache serve the overlapping windows of adjacent
+            # samples; windows become zero-copy narrow views. mmap_mode='c'
+            # (copy-on-write) keeps the array writable for torch.from_numpy
+            # without ever touching the file.
+            packed_path = os.path.join(processed_path, "packed.npy")
+            if os.path.exists(packed_path):
+                self._seq_tensor[seq] = torch.from_numpy(
+                    np.load(packed_path, mmap_mode="c")
+                )
+                n_frames = len(self._seq_tensor[seq])
+            else:
+                scan_path_range = os.path.join(processed_path, "range")
+                scan_path_xyz = os.path.join(processed_path, "xyz")
+
+                manifest_path = os.path.join(processed_path, "manifest.npy")
+                if os.path.exists(manifest_path):
+                    # One manifest read instead of walking the frame
+                    # directories, O(1) inode lookups per sequence
+                    names = np.load(manifest_path).tolist()
+                    self.filenames_range[seq] = [
+                        os.path.join(scan_path_range, name) for name in names
+                    ]
+                    self.filenames_xyz[seq] = [
+                        os.path.join(scan_path_xyz, name) for name in names
+                    ]
+                else:
+                    self.filenames_range[seq] = load_files(scan_path_range)
+                    self.filenames_xyz[seq] = load_files(scan_path_xyz)
+                assert len(self.filenames_range[seq]) == len(self.filenames_xyz[seq])
+                n_frames = len(self.filenames_range[seq])
 
             # Get number of sequences based on number of past and future steps
             n_samples_sequence = max(
                 0,
-                len(self.filenames_range[seq])
+                n_frames
                 - self.n_past_steps
                 - self.n_future_steps
                 + 1,
             )
             #print(n_samples_sequence)
-            # Add to idx mapping
-            for sample_idx in range(n_samples_sequence):
-                scan_idx = self.n_past_steps + sample_idx - 1
-                self.idx_mapper[idx] = (seq, scan_idx)
-                idx += 1
-            self.dataset_size += n_samples_sequence
+            samples_per_seq.append(n_samples_sequence)
+
+        # Build the idx mapping columns without per-sample Python iteration:
+        # repeat the sequence ids and offset a global arange back to
+        # per-sequence scan indices
+        n_samples = np.array(samples_per_seq, dtype=np.int64)
+        self.dataset_size = int(n_samples.sum())
+        self._seq_of = np.repeat(self.sequences, n_samples).astype(np.int32)
+        starts = np.repeat(np.cumsum(n_samples) - n_samples, n_samples)
+        self._scan_of = (
+            np.arange(self.dataset_size) - starts + self.n_past_steps - 1
+        ).astype(np.int32)
         print(f"Total size of dataset {self.dataset_size}")
     def __len__(self):
         return self.dataset_size
@@ -195,73 +341,139 @@ class NuScenesRaw(Dataset):
         Returns:
             item: Dataset dictionary item
         """
-        seq, scan_idx = self.idx_mapper[idx]
+        seq = int(self._seq_of[idx])
+        scan_idx = int(self._scan_of[idx])
 
         # Load past data
-        past_data = torch.empty(
-            [self.n_past_steps, self.n_channels, self.height, self.width]
-        )
-
-        from_idx = scan_idx - self.n_past_steps + 1
-        to_idx = scan_idx
-        past_filenames_range = self.filenames_range[seq][from_idx : to_idx + 1]
-        past_filenames_xyz = self.filenames_xyz[seq][from_idx : to_idx + 1]
-        # past_filenames_intensity = self.filenames_semantic[seq][from_idx : to_idx + 1]
-
-        for t in range(self.n_past_steps):
-            past_data[t, 0, :, :] = self.load_range(past_filenames_range[t])
-            past_data[t, 1:4, :, :] = self.load_xyz(past_filenames_xyz[t])
-            #past_data[t, 4, :, :] = self.load_intensity(past_filenames_intensity[t])
+        past_data = self.load_window(seq, scan_idx - self.n_past_steps + 1, scan_idx)
 
         # Load future data
-        fut_data = torch.empty(
-            [self.n_future_steps, self.n_channels, self.height, self.width]
-        )
-
-        from_idx = scan_idx + 1
-        to_idx = scan_idx + self.n_future_steps
-        fut_filenames_range = self.filenames_range[seq][from_idx : to_idx + 1]
-        fut_filenames_xyz = self.filenames_xyz[seq][from_idx : to_idx + 1]
-        # fut_filenames_intensity = self.filenames_semantic[seq][from_idx : to_idx + 1]
-
-        for t in range(self.n_future_steps):
-            fut_data[t, 0, :, :] = self.load_range(fut_filenames_range[t])
-            fut_data[t, 1:4, :, :] = self.load_xyz(fut_filenames_xyz[t])
-            #fut_data[t, 4, :, :] = self.load_intensity(fut_filenames_intensity[t])
+        fut_data = self.load_window(seq, scan_idx + 1, scan_idx + self.n_future_steps)
 
-        item = {"past_data": past_data, "fut_data": fut_data, 
+        item = {"past_data": past_data, "fut_data": fut_data,
                 "meta": (seq, scan_idx)}
         return item
 
+    def load_window(self, seq, from_idx, to_idx):
+        """Load consecutive range and xyz frames as one (T,4,H,W) tensor"""
+        if self._use_lmdb:
+            frames = [self.load_lmdb_frame(seq, i) for i in range(from_idx, to_idx + 1)]
+            # Stacking into the float32 scratch buffer folds the fp16->fp32
+            # promotion into the copy, one pass instead of stack + .float()
+            out = self.get_scratch(to_idx - from_idx + 1)
+            np.stack(frames, out=out)
+            return torch.from_numpy(out)
+        if seq in self._seq_tensor:
+            # Zero-copy narrow into the mmapped sequence tensor; the float
+            # promotion is the only copy in this path
+            window = self._seq_tensor[seq].narrow(0, from_idx, to_idx - from_idx + 1)
+            return window.float()
+        else:
+            indices = range(from_idx, to_idx + 1)
+            if self._frame_cache_size == 0:
+                # Parallel decode of the window's frames; the LRU cache path
+                # stays serial since OrderedDict is not thread-safe
+                frames = list(_io_pool().map(lambda i: self.load_frame(seq, i), indices))
+            else:
+                frames = [self.load_frame(seq, i) for i in indices]
+            rng = np.stack([frame[0] for frame in frames])
+            xyz = np.stack([frame[1] for frame in frames])
+        out = self.get_scratch(rng.shape[0])
+        if _getitem_numba.NUMBA_AVAILABLE:
+            # Fused concat+transpose kernel, writes straight into the output
+            _getitem_numba.pack_window(
+                np.ascontiguousarray(rng, dtype=np.float32),
+                np.ascontiguousarray(xyz, dtype=np.float32),
+                out,
+            )
+            return torch.from_numpy(out)
+        data = np.concatenate([rng[..., None], xyz], axis=-1)
+        # Pre-permute in numpy so the tensor is written contiguous in CHW
+        # layout: one strided copy into the scratch buffer, no allocation
+        np.copyto(out, np.moveaxis(data, -1, 1))
+        return torch.from_numpy(out)
+
+    def load_lmdb_frame(self, seq, i):
+        """Read one float16 (4,H,W) frame from the split's LMDB"""
+        if self._lmdb_env is None:
+            self._lmdb_env = lmdb.open(
+                self._lmdb_path,
+                readonly=True,
+                lock=False,
+                readahead=False,
+                meminit=False,
+            )
+        key = "{0:03d}_{1:06d}".format(int(seq), i).encode("ascii")
+        with self._lmdb_env.begin(write=False) as txn:
+            buf = txn.get(key)
+        return np.frombuffer(buf, dtype=np.float16).reshape(
+            self.n_channels, self.height, self.width
+        )
+
+    def get_scratch(self, n_steps):
+        """Next float32 (n_steps,4,H,W) scratch buffer from the ring pool"""
+        pool = self._scratch_pool.get(n_steps)
+        if pool is None:
+            buffers = [
+                np.empty(
+                    (n_steps, self.n_channels, self.height, self.width),
+                    dtype=np.float32,
+                )
+                for _ in range(self._scratch_size)
+            ]
+            pool = [buffers, 0]
+            self._scratch_pool[n_steps] = pool
+        buffers, i = pool
+        pool[1] = (i + 1) % len(buffers)
+        return buffers[i]
+
+    def load_frame(self, seq, i):
+        """Load one (range, xyz) frame pair through the per-worker LRU cache"""
+        if self._frame_cache_size == 0:
+            return (
+                np.load(self.filenames_range[seq][i]),
+                np.load(self.filenames_xyz[seq][i])[:, :, :3],
+            )
+        key = (seq, i)
+        if key in self._frame_cache:
+            self._frame_cache.move_to_end(key)
+            return self._frame_cache[key]
+        frame = (
+            np.load(self.filenames_range[seq][i]),
+            np.load(self.filenames_xyz[seq][i])[:, :, :3],
+        )
+        self._frame_cache[key] = frame
+        if len(self._frame_cache) > self._frame_cache_size:
+            self._frame_cache.popitem(last=False)
+        return frame
+
     def load_range(self, filename):
-        """Load .npy range image as (1,height,width) tensor"""
-        rv = np.load(filename)
-        rv = torch.Tensor(rv).float()
+        """Load .npy range image as (height,width) tensor"""
+        # from_numpy shares the numpy buffer, so a float32 file is loaded
+        # without any extra copy
+        rv = torch.from_numpy(np.load(filename))
+        if rv.dtype != torch.float32:
+            rv = rv.float()
         return rv
 
     def load_xyz(self, filename):
         """Load .npy xyz values as (3,height,width) tensor"""
-        xyz = torch.Tensor(np.load(filename)).float()[:, :, :3]
-        xyz = xyz.permute(2, 0, 1)
+        # Transpose to CHW in numpy: one contiguous memcpy instead of the
+        # strided copy a torch permute-then-assign would trigger downstream
+        arr = np.ascontiguousarray(np.load(filename)[:, :, :3].transpose(2, 0, 1))
+        xyz = torch.from_numpy(arr)
+        if xyz.dtype != torch.float32:
+            xyz = xyz.float()
         return xyz
 
     def load_intensity(self, filename):
-        """Load .npy intensity values as (1,height,width) tensor"""
-        semantic_np = np.load(filename)
-        semantic_label = torch.Tensor(semantic_np)
-        foreground_mask = (
-                (semantic_label==10) | (semantic_label==11)\
-                        | (semantic_label==13) | (semantic_label==15)\
-                        | (semantic_label==18) | (semantic_label==20)\
-                        | (semantic_label==30) | (semantic_label==31)\
-                        | (semantic_label==32) | (semantic_label==51)\
-                        | (semantic_label==71)| (semantic_label==80)\
-                        | (semantic_label==81)| (semantic_label==252)\
-                        | (semantic_label==253)| (semantic_label==234)\
-                        | (semantic_label==255)| (semantic_label==257)\
-                        | (semantic_label==258)| (semantic_label==259)\
-                    ).type(torch.uint8)
-        return foreground_mask
+        """Load .npy foreground mask as (height,width) uint8 tensor"""
+        arr = np.load(filename)
+        if arr.dtype == np.uint8:
+            # Mask precomputed at preprocessing time
+            return torch.from_numpy(arr)
+        # Semantic labels, apply the foreground lookup here
+        return torch.from_numpy(np.take(self._fg_lut, arr.astype(np.int32)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# @brief:    Repack preprocessed range/xyz frames into one LMDB per split
+import os
+import argparse
+import yaml
+import lmdb
+import numpy as np
+
+from utils.utils import load_files
+
+
+def frame_key(seq, i):
+    """LMDB key for frame i of a sequence"""
+    return "{0:03d}_{1:06d}".format(int(seq), i).encode("ascii")
+
+
+def load_sequence(cfg, seq):
+    """Load one sequence as a float16 (N,4,H,W) array
+
+    Prefers the packed shard written at preprocessing time and falls back
+    to assembling the per-frame range/xyz files.
+    """
+    seqstr = "{0:03d}".format(int(seq))
+    processed_path = os.path.join(
+        cfg["DATA_CONFIG"]["PROCESSED_PATH"], seqstr, "processed"
+    )
+    packed_path = os.path.join(processed_path, "packed.npy")
+    if os.path.exists(packed_path):
+        return np.load(packed_path, mmap_mode="r")
+
+    filenames_range = load_files(os.path.join(processed_path, "range"))
+    filenames_xyz = load_files(os.path.join(processed_path, "xyz"))
+    assert len(filenames_range) == len(filenames_xyz)
+    rng = np.stack([np.load(f) for f in filenames_range])
+    xyz = np.stack([np.load(f)[:, :, :3] for f in filenames_xyz])
+    packed = np.concatenate([rng[:, None], np.moveaxis(xyz, -1, 1)], axis=1)
+    return packed.astype(np.float16)
+
+
+def pack_split(cfg, split):
+    """Write all frames of a split into a single LMDB environment
+
+    Keys follow frame_key, values are the concatenated float16 (4,H,W)
+    range+xyz image. LMDB serves mmap-backed random reads without a
+    per-item open() syscall.
+    """
+    root = cfg["DATA_CONFIG"]["PROCESSED_PATH"]
+    start = cfg["DATA_CONFIG"]["SPLIT"][split.upper()][0]["START"]
+    end = cfg["DATA_CONFIG"]["SPLIT"][split.upper()][1]["END"]
+    sequences = range(start, end + 1)
+
+    frame_bytes = 4 * cfg["DATA_CONFIG"]["HEIGHT"] * cfg["DATA_CONFIG"]["WIDTH"] * 2
+    n_frames = sum(len(load_sequence(cfg, seq)) for seq in sequences)
+    # Generous map_size, LMDB only consumes what is actually written
+    map_size = 2 * n_frames * frame_bytes + (1 << 30)
+
+    lmdb_path = os.path.join(root, "lmdb_" + split)
+    env = lmdb.open(lmdb_path, map_size=map_size)
+    with env.begin(write=True) as txn:
+        for seq in sequences:
+            frames = load_sequence(cfg, seq)
+            for i in range(len(frames)):
+                txn.put(frame_key(seq, i), np.ascontiguousarray(frames[i]).tobytes())
+            print("Packed sequence {0:03d} ({1:d} frames) into {2}".format(
+                int(seq), len(frames), lmdb_path))
+    env.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("./pack_to_lmdb.py")
+    parser.add_argument(
+        "--config", "-c", type=str, default="./config/nuscenes_parameters.yml",
+        help="Path to the config file"
+    )
+    parser.add_argument(
+        "--processed_path", "-pp", type=str, default=None,
+        help="Path to the processed dataset"
+    )
+    args, unparsed = parser.parse_known_args()
+
+    cfg = yaml.safe_load(open(args.config))
+    if args.processed_path is not None:
+        cfg["DATA_CONFIG"]["PROCESSED_PATH"] = args.processed_path
+
+    for split in ["train", "val", "test"]:
+        pack_split(cfg, split)
@@ -7,7 +7,7 @@ import numpy as np
 from pathlib import Path
 import yaml
 import os
-from utils.utils import load_files, range_projection
+from utils.utils import load_files, range_projection, foreground_lut
 import cv2
 import matplotlib
 matplotlib.use("Agg")
@@ -92,6 +92,8 @@ def prepare_data_trainval(cfg):
         lidar_token = nusc.get('sample_data', lidar_token)
         print("Processing train = ", scene_name, idx, dst_folder)
 
+        seq_range = []
+        seq_xyz = []
         while True:
             lidar_path = os.path.join(data_path_train, lidar_token['filename'])
             raw_data = np.fromfile(lidar_path, dtype=np.float32).reshape((-1, 5))
@@ -107,19 +109,23 @@ def prepare_data_trainval(cfg):
             )
             mr = np.max(proj_range)
             max_range.append(mr)
+            seq_range.append(proj_range)
+            seq_xyz.append(proj_vertex[:, :, :3])
             # print("max range =", np.max(max_range))
             dst_path_range = os.path.join(dst_folder, "range")
             if not os.path.exists(dst_path_range):
                 os.makedirs(dst_path_range)
             file_path = os.path.join(dst_path_range, str(idx).zfill(3))
-            np.save(file_path, proj_range)
+            # float16 halves disk and I/O volume; relative error is <0.1%
+            # within the LiDAR operating range
+            np.save(file_path, proj_range.astype(np.float16))
 
             # Save xyz
             dst_path_xyz = os.path.join(dst_folder, "xyz")
             if not os.path.exists(dst_path_xyz):
                 os.makedirs(dst_path_xyz)
             file_path = os.path.join(dst_path_xyz, str(idx).zfill(3))
-            np.save(file_path, proj_vertex)
+            np.save(file_path, proj_vertex.astype(np.float16))
 
             # Save intensity
             dst_path_intensity = os.path.join(dst_folder, "intensity")
@@ -145,6 +151,19 @@ def prepare_data_trainval(cfg):
             prev_token = lidar_token["sample_token"]
             lidar_token = nusc.get('sample_data', lidar_token["next"])
 
+        # Repack the whole sequence into a single float16 (N,4,H,W) shard so
+        # that the dataloader can mmap one file per sequence and slice out
+        # sample windows as zero-copy views
+        rng = np.stack(seq_range)
+        xyz = np.stack(seq_xyz)
+        packed = np.concatenate([rng[:, None], np.moveaxis(xyz, -1, 1)], axis=1)
+        np.save(os.path.join(dst_folder, "packed"), packed.astype(np.float16))
+
+        # Manifest of per-frame filenames so the dataloader does not have to
+        # walk the directories at init
+        frame_names = [str(i).zfill(3) + ".npy" for i in range(idx)]
+        np.save(os.path.join(dst_folder, "manifest"), np.array(frame_names))
+
     #   VALIDATION SET GENERATION
     scenes = list(filter(lambda x: x in available_scene_names, val_scenes))
     scenes = set([available_scenes[available_scene_names.index(s)]['token'] for s in scenes])
@@ -183,6 +202,8 @@ def prepare_data_trainval(cfg):
         lidar_token = nusc.get('sample_data', lidar_token)
         print("Processing val = ", scene_name, idx, dst_folder)
 
+        seq_range = []
+        seq_xyz = []
         while True:
             lidar_path = os.path.join(data_path_train, lidar_token['filename'])
             raw_data = np.fromfile(lidar_path, dtype=np.float32).reshape((-1, 5))
@@ -198,19 +219,23 @@ def prepare_data_trainval(cfg):
             )
             mr = np.max(proj_range)
             max_range.append(mr)
+            seq_range.append(proj_range)
+            seq_xyz.append(proj_vertex[:, :, :3])
             # print("max range =", np.max(max_range))
             dst_path_range = os.path.join(dst_folder, "range")
             if not os.path.exists(dst_path_range):
                 os.makedirs(dst_path_range)
             file_path = os.path.join(dst_path_range, str(idx).zfill(3))
-            np.save(file_path, proj_range)
+            # float16 halves disk and I/O volume; relative error is <0.1%
+            # within the LiDAR operating range
+            np.save(file_path, proj_range.astype(np.float16))
 
             # Save xyz
             dst_path_xyz = os.path.join(dst_folder, "xyz")
             if not os.path.exists(dst_path_xyz):
                 os.makedirs(dst_path_xyz)
             file_path = os.path.join(dst_path_xyz, str(idx).zfill(3))
-            np.save(file_path, proj_vertex)
+            np.save(file_path, proj_vertex.astype(np.float16))
 
             # Save intensity
             dst_path_intensity = os.path.join(dst_folder, "intensity")
@@ -235,12 +260,46 @@ def prepare_data_trainval(cfg):
                 break
             prev_token = lidar_token["sample_token"]
             lidar_token = nusc.get('sample_data', lidar_token["next"])
+
+        # Repack the whole sequence into a single float16 (N,4,H,W) shard so
+        # that the dataloader can mmap one file per sequence and slice out
+        # sample windows as zero-copy views
+        rng = np.stack(seq_range)
+        xyz = np.stack(seq_xyz)
+        packed = np.concatenate([rng[:, None], np.moveaxis(xyz, -1, 1)], axis=1)
+        np.save(os.path.join(dst_folder, "packed"), packed.astype(np.float16))
+
+        # Manifest of per-frame filenames so the dataloader does not have to
+        # walk the directories at init
+        frame_names = [str(i).zfill(3) + ".npy" for i in range(idx)]
+        np.save(os.path.join(dst_folder, "manifest"), np.array(frame_names))
             
     print(len(max_range))
     return scene_name
 
 
 
+def precompute_foreground(cfg):
+    """Precompute uint8 foreground masks from saved semantic labels
+
+    The mask is static given the labels, so it is applied once here instead
+    of once per epoch in the dataloader. Sequences without a semantic
+    folder are skipped.
+    """
+    lut = foreground_lut()
+    root = cfg["DATA_CONFIG"]["PROCESSED_PATH"]
+    for seqstr in sorted(os.listdir(root)):
+        semantic_path = os.path.join(root, seqstr, "processed", "semantic")
+        if not os.path.isdir(semantic_path):
+            continue
+        foreground_path = os.path.join(root, seqstr, "processed", "foreground")
+        if not os.path.exists(foreground_path):
+            os.makedirs(foreground_path)
+        for filename in load_files(semantic_path):
+            mask = np.take(lut, np.load(filename).astype(np.int32))
+            np.save(os.path.join(foreground_path, os.path.basename(filename)), mask)
+
+
 def prepare_data_test(cfg, scene_name):
     #Path(cfg["DATA_CONFIG"]["SAVE_PATH"]).mkdir(parents=True, exist_ok=True)
     # if not os.path.exists(cfg["DATA_CONFIG"]["SAVE_PATH"]):
@@ -319,6 +378,8 @@ def prepare_data_test(cfg, scene_name):
         lidar_token = nusc.get('sample_data', lidar_token)
         print("Processing train = ", scene_name, idx, dst_folder)
 
+        seq_range = []
+        seq_xyz = []
         while True:
             lidar_path = os.path.join(data_path_train, lidar_token['filename'])
             raw_data = np.fromfile(lidar_path, dtype=np.float32).reshape((-1, 5))
@@ -334,19 +395,23 @@ def prepare_data_test(cfg, scene_name):
             )
             mr = np.max(proj_range)
             max_range.append(mr)
+            seq_range.append(proj_range)
+            seq_xyz.append(proj_vertex[:, :, :3])
             # print("max range =", np.max(max_range))
             dst_path_range = os.path.join(dst_folder, "range")
             if not os.path.exists(dst_path_range):
                 os.makedirs(dst_path_range)
             file_path = os.path.join(dst_path_range, str(idx).zfill(3))
-            np.save(file_path, proj_range)
+            # float16 halves disk and I/O volume; relative error is <0.1%
+            # within the LiDAR operating range
+            np.save(file_path, proj_range.astype(np.float16))
 
             # Save xyz
             dst_path_xyz = os.path.join(dst_folder, "xyz")
             if not os.path.exists(dst_path_xyz):
                 os.makedirs(dst_path_xyz)
             file_path = os.path.join(dst_path_xyz, str(idx).zfill(3))
-            np.save(file_path, proj_vertex)
+            np.save(file_path, proj_vertex.astype(np.float16))
 
             # Save intensity
             dst_path_intensity = os.path.join(dst_folder, "intensity")
@@ -372,6 +437,19 @@ def prepare_data_test(cfg, scene_name):
             prev_token = lidar_token["sample_token"]
             lidar_token = nusc.get('sample_data', lidar_token["next"])
 
+        # Repack the whole sequence into a single float16 (N,4,H,W) shard so
+        # that the dataloader can mmap one file per sequence and slice out
+        # sample windows as zero-copy views
+        rng = np.stack(seq_range)
+        xyz = np.stack(seq_xyz)
+        packed = np.concatenate([rng[:, None], np.moveaxis(xyz, -1, 1)], axis=1)
+        np.save(os.path.join(dst_folder, "packed"), packed.astype(np.float16))
+
+        # Manifest of per-frame filenames so the dataloader does not have to
+        # walk the directories at init
+        frame_names = [str(i).zfill(3) + ".npy" for i in range(idx)]
+        np.save(os.path.join(dst_folder, "manifest"), np.array(frame_names))
+
     #   VALIDATION SET GENERATION
     scenes = list(filter(lambda x: x in available_scene_names, val_scenes))
     scenes = set([available_scenes[available_scene_names.index(s)]['token'] for s in scenes])
@@ -410,6 +488,8 @@ def prepare_data_test(cfg, scene_name):
         lidar_token = nusc.get('sample_data', lidar_token)
         print("Processing val = ", scene_name, idx, dst_folder)
 
+        seq_range = []
+        seq_xyz = []
         while True:
             lidar_path = os.path.join(data_path_train, lidar_token['filename'])
             raw_data = np.fromfile(lidar_path, dtype=np.float32).reshape((-1, 5))
@@ -425,19 +505,23 @@ def prepare_data_test(cfg, scene_name):
             )
             mr = np.max(proj_range)
             max_range.append(mr)
+            seq_range.append(proj_range)
+            seq_xyz.append(proj_vertex[:, :, :3])
             # print("max range =", np.max(max_range))
             dst_path_range = os.path.join(dst_folder, "range")
             if not os.path.exists(dst_path_range):
                 os.makedirs(dst_path_range)
             file_path = os.path.join(dst_path_range, str(idx).zfill(3))
-            np.save(file_path, proj_range)
+            # float16 halves disk and I/O volume; relative error is <0.1%
+            # within the LiDAR operating range
+            np.save(file_path, proj_range.astype(np.float16))
 
             # Save xyz
             dst_path_xyz = os.path.join(dst_folder, "xyz")
             if not os.path.exists(dst_path_xyz):
                 os.makedirs(dst_path_xyz)
             file_path = os.path.join(dst_path_xyz, str(idx).zfill(3))
-            np.save(file_path, proj_vertex)
+            np.save(file_path, proj_vertex.astype(np.float16))
 
             # Save intensity
             dst_path_intensity = os.path.join(dst_folder, "intensity")
@@ -462,6 +546,19 @@ def prepare_data_test(cfg, scene_name):
                 break
             prev_token = lidar_token["sample_token"]
             lidar_token = nusc.get('sample_data', lidar_token["next"])
+
+        # Repack the whole sequence into a single float16 (N,4,H,W) shard so
+        # that the dataloader can mmap one file per sequence and slice out
+        # sample windows as zero-copy views
+        rng = np.stack(seq_range)
+        xyz = np.stack(seq_xyz)
+        packed = np.concatenate([rng[:, None], np.moveaxis(xyz, -1, 1)], axis=1)
+        np.save(os.path.join(dst_folder, "packed"), packed.astype(np.float16))
+
+        # Manifest of per-frame filenames so the dataloader does not have to
+        # walk the directories at init
+        frame_names = [str(i).zfill(3) + ".npy" for i in range(idx)]
+        np.save(os.path.join(dst_folder, "manifest"), np.array(frame_names))
     print(len(max_range))
 
     
@@ -473,4 +570,5 @@ if __name__ == "__main__":
         os.makedirs(cfg["DATA_CONFIG"]["SAVE_PATH"])
     scene_name = prepare_data_trainval(cfg)
     prepare_data_test(cfg, scene_name)
+    precompute_foreground(cfg)
 
@@ -35,6 +35,13 @@ class projection:
         self.y_fac = torch.cos(pitch) * torch.sin(yaw)
         self.z_fac = torch.sin(pitch)
 
+        # Place the reprojection factors in shared memory so that forked
+        # DataLoader workers map the same pages instead of each holding a
+        # private HxW copy. They are only read after init, never mutated.
+        self.x_fac.share_memory_()
+        self.y_fac.share_memory_()
+        self.z_fac.share_memory_()
+
     def get_valid_points_from_range_view(self, range_view, use_batch = False):
         """Reproject from range image to valid 3D points
 
@@ -250,6 +250,15 @@ def load_vertex(scan_path):
     return current_vertex
 
 
+def foreground_lut():
+    """Lookup table mapping a semantic label to a uint8 foreground flag."""
+    foreground_labels = [10, 11, 13, 15, 18, 20, 30, 31, 32, 51, 71, 80,
+                         81, 234, 252, 253, 255, 257, 258, 259]
+    lut = np.zeros(max(foreground_labels) + 1, dtype=np.uint8)
+    lut[foreground_labels] = 1
+    return lut
+
+
 def load_files(folder):
     """Load all files in a folder and sort."""
     file_paths = [